@@ -1,12 +1,25 @@
 import os
-import hashlib
+import hmac
+import logging
+import time
+import bisect
+import itertools
+import queue
+import atexit
+import threading
 import certifi
+import numpy as np
+import mmh3
+import orjson
 from datetime import datetime
 from pathlib import Path 
-from functools import wraps
+from functools import wraps, lru_cache
 from flask_cors import CORS
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 
@@ -15,86 +28,351 @@ base_dir = Path(__file__).resolve().parent
 env_path = base_dir / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# --- JSON SERIALIZATION ---
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """Routes jsonify() through orjson (handles datetime natively, ObjectId via default)"""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024  # keeps every stored document far below Mongo's 16 MB limit
 CORS(app)
 
+# Under gunicorn, log through its handlers and level instead of Flask's default stderr handler
+if __name__ != '__main__':
+    gunicorn_logger = logging.getLogger('gunicorn.error')
+    if gunicorn_logger.handlers:
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+
 MONGO_URI = os.environ.get("MONGO_URI")
 ADMIN_KEY = os.environ.get("ADMIN_KEY") # <--- NEW SECRET PASSWORD
 
 if not MONGO_URI:
     raise ValueError("CRITICAL ERROR: No MONGO_URI found! Please check your .env file.")
 
-client = MongoClient(MONGO_URI, tlsCAFile=certifi.where(), tlsAllowInvalidCertificates=True)
+client = MongoClient(
+    MONGO_URI,
+    tlsCAFile=certifi.where(),
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=5000,
+    retryWrites=True,
+    compressors='zstd'
+)
 db = client['variant_db']
+client.admin.command('ping')  # fail fast on a bad URI and open the first connection before serving
+
+def ensure_indexes():
+    db.experiments.create_index("status")
+    try:
+        db.experiments.create_index("key", unique=True)
+    except OperationFailure:
+        # Existing duplicate keys; keep serving without the constraint until they are fixed
+        app.logger.error("Could not create unique index on experiments.key; "
+                         "run find_duplicate_keys.py to list the duplicates", exc_info=True)
+    db.events.create_index([("experiment_id", 1), ("event_name", 1), ("variant_name", 1)])
+
+ensure_indexes()
+
+# Active experiments are cached per process; writes below reset the timestamp.
+_CACHE_TTL = 5.0
+_exp_cache = {"ts": float("-inf"), "data": []}
+
+# Tracked events are queued and bulk-inserted by a background thread.
+# Anything still queued when the process is killed (at most ~0.2s worth) is lost.
+# The queue is bounded so a Mongo outage sheds load (503) instead of exhausting memory.
+_EVENT_BATCH_SIZE = 500
+_EVENT_FLUSH_INTERVAL = 0.2
+_EVENT_QUEUE_MAX = 50000
+_EVENT_RETRY_MIN = 0.5
+_EVENT_RETRY_MAX = 10.0
+_event_queue = queue.Queue(maxsize=_EVENT_QUEUE_MAX)
+_EVENT_FIELDS = ('userId', 'experimentId', 'variantName', 'event')
+
+_MAX_BATCH_USERS = 1000
+_STREAM_THRESHOLD = 200  # /api/config streams only when there are more active experiments than this
+_STREAM_CHUNK_SIZE = 200  # experiments serialized per streamed write
 
 # --- SECURITY DECORATOR ---
+_ADMIN_KEY_BYTES = ADMIN_KEY.encode('utf-8') if ADMIN_KEY else None
+
 def require_api_key(f):
+    # 1. If no password is set on server, allow everything (Dev Mode)
+    if _ADMIN_KEY_BYTES is None:
+        return f
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # 1. If no password is set on server, allow everything (Dev Mode)
-        if not ADMIN_KEY:
-            return f(*args, **kwargs)
-        
-        # 2. Check the header
-        request_key = request.headers.get('X-Admin-Key')
-        if request_key != ADMIN_KEY:
+        # 2. Check the header (constant-time compare)
+        request_key = request.headers.get('X-Admin-Key', '').encode('utf-8')
+        if not hmac.compare_digest(request_key, _ADMIN_KEY_BYTES):
             return jsonify({"error": "Unauthorized: Invalid or missing Admin Key"}), 401
-            
+
         return f(*args, **kwargs)
     return decorated_function
 
 # --- HELPER FUNCTIONS ---
-def get_bucket(user_id, experiment_id):
-    raw_string = f"{user_id}:{experiment_id}"
-    hash_object = hashlib.md5(raw_string.encode('utf-8'))
-    hash_int = int(hash_object.hexdigest(), 16)
-    return hash_int % 100
+def get_bucket(user_id_bytes, experiment_oid_bytes):
+    # Hashes the raw 12-byte ObjectId rather than its hex string
+    return mmh3.hash(user_id_bytes + b':' + experiment_oid_bytes, signed=False) % 100
 
 def select_variant(experiment, bucket):
-    cumulative_threshold = 0
-    for variant in experiment['variants']:
-        cumulative_threshold += variant.get('traffic_percentage', 0)
-        if bucket < cumulative_threshold:
-            return variant
-    return experiment['variants'][-1]
+    # 'thresholds' holds the running sum of traffic_percentage (see get_active_experiments)
+    variants = experiment['variants']
+    idx = bisect.bisect_right(experiment['thresholds'], bucket)
+    return variants[min(idx, len(variants) - 1)]
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+def is_bson_scalar(value):
+    """True for JSON scalars BSON can store (ints beyond int64 cannot be encoded)"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return _INT64_MIN <= value <= _INT64_MAX
+    return value is None or isinstance(value, (str, float, bool))
+
+@lru_cache(maxsize=256)
+def _oid(s):
+    return ObjectId(s)
+
+def to_object_id(value):
+    """Events store experiment_id as an ObjectId; anything unparseable is kept as-is"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return _oid(value)
+    except InvalidId:
+        return value
+
+def assign_variants_batch(user_ids, experiments):
+    """Variant index per (user, experiment); same assignment as select_variant(get_bucket(...))"""
+    oid_bytes = [exp['oid_bytes'] for exp in experiments]
+    user_id_bytes = [user_id.encode('utf-8') for user_id in user_ids]
+    buckets = np.array(
+        [[get_bucket(user, oid) for oid in oid_bytes] for user in user_id_bytes],
+        dtype=np.int64
+    ).reshape(len(user_ids), len(experiments))
+
+    # traffic_percentage may be fractional (e.g. 33.5/33.5/33); ragged rows are padded with inf
+    width = max(len(exp['thresholds']) for exp in experiments)
+    thresholds = np.full((len(experiments), width), np.inf, dtype=np.float64)
+    for j, exp in enumerate(experiments):
+        thresholds[j, :len(exp['thresholds'])] = exp['thresholds']
+
+    assignments = np.empty_like(buckets)
+    for j in range(len(experiments)):
+        assignments[:, j] = np.searchsorted(thresholds[j], buckets[:, j], side='right')
+    last_index = np.array([len(exp['variants']) - 1 for exp in experiments], dtype=np.int64)
+    return np.minimum(assignments, last_index)
+
+# Event filters shared by the admin summary and stats-reset endpoints
+def events_filter(experiment_oid):
+    return {"experiment_id": experiment_oid}
+
+def summary_match(experiment_oid):
+    return {"experiment_id": experiment_oid, "event_name": {"$in": ["exposure", "conversion"]}}
+
+_SUMMARY_GROUP = {"_id": {"v": "$variant_name", "e": "$event_name"}, "c": {"$sum": 1}}
+
+def get_active_experiments():
+    now = time.monotonic()
+    if now - _exp_cache["ts"] > _CACHE_TTL:
+        docs = db.experiments.find(
+            {"status": "active"},
+            {"_id": 1, "key": 1, "variants.traffic_percentage": 1, "variants.value": 1}
+        )
+        _exp_cache["data"] = [
+            {
+                "id": str(exp['_id']),
+                "oid_bytes": exp['_id'].binary,
+                "key": exp['key'],
+                "variants": exp['variants'],
+                "thresholds": list(itertools.accumulate(v.get('traffic_percentage', 0) for v in exp['variants']))
+            }
+            for exp in docs
+        ]
+        _exp_cache["ts"] = now
+    return _exp_cache["data"]
+
+def invalidate_experiment_cache():
+    _exp_cache["ts"] = float("-inf")
+
+# --- EVENT WRITER ---
+def _drain_up_to(max_items, timeout):
+    try:
+        batch = [_event_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while len(batch) < max_items:
+        try:
+            batch.append(_event_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _write_events(batch):
+    """Returns False when Mongo is unreachable and the batch must be retried"""
+    try:
+        db.events.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # Unordered: every document the server did not reject was still written.
+        # This also covers a retried batch whose first attempt partly succeeded (duplicate _id).
+        app.logger.error("Server rejected %d of %d tracked events", len(e.details.get('writeErrors', [])), len(batch))
+    except AutoReconnect:
+        # Includes ServerSelectionTimeoutError: election, network blip, outage
+        app.logger.warning("Mongo unreachable, will retry %d tracked events", len(batch))
+        return False
+    except PyMongoError:
+        app.logger.exception("Failed to write %d tracked events", len(batch))
+    except Exception:
+        # A document that could not be encoded; write the rest one at a time.
+        # insert_many already assigned each _id, so nothing written before the error is duplicated.
+        for doc in batch:
+            try:
+                db.events.insert_one(doc)
+            except Exception:
+                app.logger.exception("Dropped unwritable tracked event")
+    return True
+
+def _event_writer():
+    # A batch that hit a transient error is retried before anything new is drained,
+    # so during an outage the queue fills up and /api/track answers 503.
+    pending = []
+    delay = _EVENT_RETRY_MIN
+    while True:
+        try:
+            batch = pending or _drain_up_to(_EVENT_BATCH_SIZE, _EVENT_FLUSH_INTERVAL)
+            pending = []
+            if batch and not _write_events(batch):
+                pending = batch
+                time.sleep(delay)
+                delay = min(delay * 2, _EVENT_RETRY_MAX)
+            else:
+                delay = _EVENT_RETRY_MIN
+        except Exception:
+            app.logger.exception("Event writer error")
+
+def _flush_events():
+    while True:
+        batch = _drain_up_to(_EVENT_BATCH_SIZE, 0)
+        if not batch:
+            return
+        if not _write_events(batch):
+            # Shutting down: no time to wait for Mongo to come back
+            app.logger.error("Dropped %d tracked events at exit", len(batch) + _event_queue.qsize())
+            return
+
+threading.Thread(target=_event_writer, name="event-writer", daemon=True).start()
+atexit.register(_flush_events)
 
 # --- PUBLIC ENDPOINTS (No Lock) ---
 
+_HOME_BODY = orjson.dumps({"status": "Variant Backend is Active", "database": "Connected"})
+
 @app.route('/')
 def home():
-    return {"status": "Variant Backend is Active", "database": "Connected"}, 200
+    return Response(_HOME_BODY, status=200, mimetype='application/json')
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
     user_id = request.args.get('userId')
     if not user_id: return jsonify({"error": "userId is required"}), 400
 
-    active_experiments = db.experiments.find({"status": "active"})
-    config_list = []
-
-    for exp in active_experiments:
-        exp_id = str(exp['_id'])
-        bucket = get_bucket(user_id, exp_id)
-        assigned_variant = select_variant(exp, bucket)
-        config_list.append({
-            "experimentId": exp_id,
-            "key": exp['key'],
-            "value": assigned_variant['value']
-        })
+    user_id_bytes = user_id.encode('utf-8')
+    active_experiments = get_active_experiments()
+
+    # Typical payloads are small and fully computable up front: one write, errors become a 500
+    if len(active_experiments) <= _STREAM_THRESHOLD:
+        return jsonify([
+            {
+                "experimentId": exp['id'],
+                "key": exp['key'],
+                "value": select_variant(exp, get_bucket(user_id_bytes, exp['oid_bytes']))['value']
+            }
+            for exp in active_experiments
+        ]), 200
+
+    def generate():
+        # Emit the JSON array a chunk of experiments at a time, encoded like jsonify()
+        option = app.json.option
+        for start in range(0, len(active_experiments), _STREAM_CHUNK_SIZE):
+            body = b','.join(
+                orjson.dumps({
+                    "experimentId": exp['id'],
+                    "key": exp['key'],
+                    "value": select_variant(exp, get_bucket(user_id_bytes, exp['oid_bytes']))['value']
+                }, default=_orjson_default, option=option)
+                for exp in active_experiments[start:start + _STREAM_CHUNK_SIZE]
+            )
+            yield (b'[' if start == 0 else b',') + body
+        yield b']'
 
-    return jsonify(config_list), 200
+    return Response(generate(), status=200, mimetype='application/json')
+
+@app.route('/api/config/batch', methods=['POST'])
+def get_config_batch():
+    data = request.json
+    user_ids = data.get('userIds') if isinstance(data, dict) else None
+    if not isinstance(user_ids, list) or not all(isinstance(u, str) and u for u in user_ids):
+        return jsonify({"error": "userIds must be a list of non-empty strings"}), 400
+    if len(user_ids) > _MAX_BATCH_USERS:
+        return jsonify({"error": f"At most {_MAX_BATCH_USERS} userIds per request"}), 400
+
+    active_experiments = get_active_experiments()
+    if not active_experiments or not user_ids:
+        return jsonify([{"userId": user_id, "config": []} for user_id in user_ids]), 200
+
+    assignments = assign_variants_batch(user_ids, active_experiments).tolist()
+    results = [
+        {
+            "userId": user_id,
+            "config": [
+                {"experimentId": exp['id'], "key": exp['key'], "value": exp['variants'][idx]['value']}
+                for exp, idx in zip(active_experiments, row)
+            ]
+        }
+        for user_id, row in zip(user_ids, assignments)
+    ]
+    return jsonify(results), 200
 
 @app.route('/api/track', methods=['POST'])
 def track_event():
     data = request.json
-    event_doc = {
-        "user_id": data.get('userId'),
-        "experiment_id": data.get('experimentId'),
-        "variant_name": data.get('variantName'),
-        "event_name": data.get('event'), 
-        "timestamp": datetime.utcnow()
-    }
-    db.events.insert_one(event_doc)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid payload"}), 400
+    # Events are written after the response is sent, so reject anything Mongo could not store now
+    for field in _EVENT_FIELDS:
+        if not is_bson_scalar(data.get(field)):
+            return jsonify({"error": f"{field} must be a string, number, boolean or null"}), 400
+
+    try:
+        _event_queue.put_nowait({
+            "user_id": data.get('userId'),
+            "experiment_id": to_object_id(data.get('experimentId')),
+            "variant_name": data.get('variantName'),
+            "event_name": data.get('event'),
+            "timestamp": datetime.utcnow()
+        })
+    except queue.Full:
+        return jsonify({"error": "Event queue is full, retry later"}), 503
     return jsonify({"status": "recorded"}), 201
 
 # --- ADMIN ENDPOINTS (LOCKED) ---
@@ -103,7 +381,9 @@ def track_event():
 def login():
     """Validates the password before frontend saves it"""
     data = request.json
-    if data.get("password") == ADMIN_KEY:
+    password = data.get("password") if isinstance(data, dict) else None
+    if _ADMIN_KEY_BYTES is not None and isinstance(password, str) \
+            and hmac.compare_digest(password.encode('utf-8'), _ADMIN_KEY_BYTES):
         return jsonify({"status": "ok"}), 200
     return jsonify({"error": "Invalid password"}), 401
 
@@ -125,7 +405,11 @@ def create_experiment():
         "variants": data['variants'],
         "created_at": datetime.utcnow()
     }
-    result = db.experiments.insert_one(new_experiment)
+    try:
+        result = db.experiments.insert_one(new_experiment)
+    except DuplicateKeyError:
+        return jsonify({"error": f"Experiment key '{data['key']}' already exists"}), 409
+    invalidate_experiment_cache()
     return jsonify({"message": "Experiment created", "id": str(result.inserted_id)}), 201
 
 @app.route('/api/admin/experiments', methods=['GET'])
@@ -138,6 +422,7 @@ def get_all_experiments():
 @require_api_key # <--- LOCKED
 def delete_experiment(key):
     result = db.experiments.delete_one({"key": key})
+    invalidate_experiment_cache()
     if result.deleted_count > 0:
         return jsonify({"message": "Deleted"}), 200
     return jsonify({"error": "Not found"}), 404
@@ -159,6 +444,7 @@ def update_experiment(key):
     if not update_fields: return jsonify({"error": "No valid fields"}), 400
 
     result = db.experiments.update_one({"key": key}, {"$set": update_fields})
+    invalidate_experiment_cache()
     if result.matched_count == 0: return jsonify({"error": "Experiment not found"}), 404
         
     return jsonify({"message": "Updated successfully"}), 200
@@ -166,32 +452,35 @@ def update_experiment(key):
 @app.route('/api/admin/stats/<experiment_key>', methods=['DELETE'])
 @require_api_key # <--- LOCKED
 def reset_experiment_stats(experiment_key):
-    experiment = db.experiments.find_one({"key": experiment_key})
+    experiment = db.experiments.find_one({"key": experiment_key}, {"_id": 1})
     if not experiment: return jsonify({"error": "Experiment not found"}), 404
         
-    exp_id_str = str(experiment['_id'])
-    result = db.events.delete_many({
-        "$or": [{"experiment_id": exp_id_str}, {"experiment_id": ObjectId(exp_id_str)}, {"experimentId": exp_id_str}]
-    })
+    result = db.events.delete_many(events_filter(experiment['_id']))
     return jsonify({"message": f"Cleared {result.deleted_count} events"}), 200
 
 @app.route('/api/admin/summary/<experiment_key>', methods=['GET'])
 @require_api_key # <--- LOCKED
 def get_experiment_summary(experiment_key):
-    experiment = db.experiments.find_one({"key": experiment_key})
+    experiment = db.experiments.find_one({"key": experiment_key}, {"_id": 1, "name": 1})
     if not experiment: return jsonify({"error": f"Experiment '{experiment_key}' not found"}), 404
     
-    exp_id_str = str(experiment['_id'])
     pipeline = [
-        {"$match": {"$or": [{"experiment_id": exp_id_str}, {"experiment_id": ObjectId(exp_id_str)}]}},
-        {"$group": {
-            "_id": "$variant_name",
-            "exposures": {"$sum": {"$cond": [{"$eq": ["$event_name", "exposure"]}, 1, 0]}},
-            "conversions": {"$sum": {"$cond": [{"$eq": ["$event_name", "conversion"]}, 1, 0]}}
-        }}
+        {"$match": summary_match(experiment['_id'])},
+        {"$group": _SUMMARY_GROUP}
     ]
-    results = list(db.events.aggregate(pipeline))
+
+    # Pivot (variant, event) counts into one row per variant
+    counters = {"exposure": "exposures", "conversion": "conversions"}
+    variants = {}
+    for row in db.events.aggregate(pipeline):
+        variant_name = row['_id'].get('v')
+        if variant_name not in variants:
+            variants[variant_name] = {"_id": variant_name, "exposures": 0, "conversions": 0}
+        variants[variant_name][counters[row['_id']['e']]] = row['c']
+
+    results = list(variants.values())
     return jsonify({"experiment_name": experiment.get('name'), "aggregated_variants": results}), 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Local development only; production runs `gunicorn app:app` (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Lists experiments that share a `key`, which blocks the unique index on experiments.key.
+
+Rename or delete all but one experiment per key, then restart the app to create the index:
+    python find_duplicate_keys.py
+"""
+import os
+import sys
+import certifi
+from pathlib import Path
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+base_dir = Path(__file__).resolve().parent
+load_dotenv(dotenv_path=base_dir / '.env')
+
+MONGO_URI = os.environ.get("MONGO_URI")
+if not MONGO_URI:
+    raise ValueError("CRITICAL ERROR: No MONGO_URI found! Please check your .env file.")
+
+client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
+experiments = client['variant_db'].experiments
+
+duplicates = list(experiments.aggregate([
+    {"$group": {
+        "_id": "$key",
+        "count": {"$sum": 1},
+        "experiments": {"$push": {"id": "$_id", "name": "$name", "status": "$status", "created_at": "$created_at"}}
+    }},
+    {"$match": {"count": {"$gt": 1}}},
+    {"$sort": {"_id": 1}}
+]))
+
+if not duplicates:
+    print("No duplicate experiment keys")
+    sys.exit(0)
+
+for group in duplicates:
+    print(f"key '{group['_id']}' is used by {group['count']} experiments:")
+    for exp in group['experiments']:
+        print(f"  {exp['id']}  status={exp.get('status')}  created_at={exp.get('created_at')}  name={exp.get('name')}")
+sys.exit(1)
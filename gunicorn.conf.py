@@ -0,0 +1,12 @@
+# Picked up automatically by `gunicorn app:app` when run from this directory.
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = 8
+
+# Each worker imports app.py itself (no preload), so every process gets its
+# own MongoClient pool and event-writer thread.
+preload_app = False
@@ -0,0 +1,37 @@
+"""One-time backfill: store every event's experiment as an ObjectId in `experiment_id`.
+
+Older events were written with `experimentId` and/or a string `experiment_id`.
+Run once after deploying the normalized /api/track:  python migrate_event_ids.py
+"""
+import os
+import certifi
+from pathlib import Path
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+base_dir = Path(__file__).resolve().parent
+load_dotenv(dotenv_path=base_dir / '.env')
+
+MONGO_URI = os.environ.get("MONGO_URI")
+if not MONGO_URI:
+    raise ValueError("CRITICAL ERROR: No MONGO_URI found! Please check your .env file.")
+
+client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
+events = client['variant_db'].events
+
+# 1. Legacy field name -> experiment_id
+renamed = events.update_many(
+    {"experimentId": {"$exists": True}, "experiment_id": {"$exists": False}},
+    {"$rename": {"experimentId": "experiment_id"}}
+)
+dropped = events.update_many({"experimentId": {"$exists": True}}, {"$unset": {"experimentId": ""}})
+
+# 2. String ids -> ObjectId (anything that is not 24 hex chars is left untouched)
+converted = events.update_many(
+    {"experiment_id": {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}},
+    [{"$set": {"experiment_id": {"$toObjectId": "$experiment_id"}}}]
+)
+
+print(f"Renamed experimentId on {renamed.modified_count} events")
+print(f"Removed duplicate experimentId from {dropped.modified_count} events")
+print(f"Converted {converted.modified_count} string experiment_id values to ObjectId")
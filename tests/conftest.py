@@ -0,0 +1,33 @@
+import os
+import sys
+from pathlib import Path
+
+import mongomock
+import pymongo
+import pytest
+
+# app.py connects at import time; point it at an in-memory mongomock server instead
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("ADMIN_KEY", "test-admin-key")
+pymongo.MongoClient = mongomock.MongoClient
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app_ctx():
+    app_module.db.experiments.delete_many({})
+    app_module.db.events.delete_many({})
+    app_module.invalidate_experiment_cache()
+    return app_module
+
+
+@pytest.fixture
+def client(app_ctx):
+    return app_ctx.app.test_client()
+
+
+@pytest.fixture
+def admin_headers():
+    return {"X-Admin-Key": os.environ["ADMIN_KEY"]}
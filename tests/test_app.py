@@ -0,0 +1,254 @@
+import queue
+import time
+
+from bson.objectid import ObjectId
+from pymongo.errors import ServerSelectionTimeoutError
+
+
+def wait_for_events(app_ctx, query, expected, timeout=2.0):
+    """Events are written by the background writer; flush and poll until they land"""
+    deadline = time.monotonic() + timeout
+    app_ctx._flush_events()
+    while app_ctx.db.events.count_documents(query) != expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return app_ctx.db.events.count_documents(query)
+
+
+def test_home(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "Variant Backend is Active", "database": "Connected"}
+
+
+def test_create_experiment_and_get_config(client, admin_headers):
+    payload = {
+        "name": "Button colour",
+        "key": "button_color",
+        "variants": [
+            {"name": "A", "value": "red", "traffic_percentage": 50},
+            {"name": "B", "value": "blue", "traffic_percentage": 50}
+        ]
+    }
+    response = client.post('/api/experiments', json=payload, headers=admin_headers)
+    assert response.status_code == 201
+    assert response.headers['Content-Type'] == 'application/json'
+
+    response = client.get('/api/config?userId=user-1')
+    assert response.status_code == 200
+    [entry] = response.get_json()
+    assert entry["key"] == "button_color"
+    assert entry["value"] in ("red", "blue")
+
+
+def test_error_responses_are_json(client):
+    response = client.get('/api/config')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "userId is required"}
+
+    response = client.get('/api/admin/experiments')
+    assert response.status_code == 401
+
+
+def test_track_rejects_values_mongo_cannot_store(client):
+    response = client.post('/api/track', json={"userId": 18446744073709551615, "event": "exposure"})
+    assert response.status_code == 400
+    response = client.post('/api/track', json={"userId": {"nested": 1}, "event": "exposure"})
+    assert response.status_code == 400
+
+
+def test_track_accepts_numeric_user_id(client, app_ctx):
+    response = client.post('/api/track', json={"userId": 42, "event": "exposure"})
+    assert response.status_code == 201
+    assert wait_for_events(app_ctx, {"user_id": 42}, 1) == 1
+
+
+def test_unwritable_event_does_not_drop_its_batch(app_ctx):
+    good = {"user_id": "user-1", "event_name": "exposure"}
+    bad = {"user_id": 18446744073709551615, "event_name": "exposure"}
+    app_ctx._write_events([dict(good), bad, dict(good)])
+    assert app_ctx.db.events.count_documents({"user_id": "user-1"}) == 2
+
+
+def test_tracked_events_are_written(client, app_ctx):
+    response = client.post('/api/track', json={"userId": "user-1", "experimentId": "x", "event": "exposure"})
+    assert response.status_code == 201
+    assert wait_for_events(app_ctx, {"user_id": "user-1"}, 1) == 1
+
+
+class _FullQueue(queue.Queue):
+    def put_nowait(self, item):
+        raise queue.Full
+
+
+def test_track_sheds_load_when_queue_is_full(client, app_ctx, monkeypatch):
+    monkeypatch.setattr(app_ctx, "_event_queue", _FullQueue())
+    response = client.post('/api/track', json={"userId": "user-1", "event": "exposure"})
+    assert response.status_code == 503
+
+
+def test_batch_config_matches_single_user_config(client, admin_headers):
+    payload = {
+        "name": "Fractional split",
+        "key": "fractional",
+        "variants": [
+            {"name": "A", "value": "A", "traffic_percentage": 33.5},
+            {"name": "B", "value": "B", "traffic_percentage": 33.5},
+            {"name": "C", "value": "C", "traffic_percentage": 33}
+        ]
+    }
+    assert client.post('/api/experiments', json=payload, headers=admin_headers).status_code == 201
+
+    user_ids = [f"u{i}" for i in range(400)]
+    response = client.post('/api/config/batch', json={"userIds": user_ids})
+    assert response.status_code == 200
+    for row in response.get_json():
+        single = client.get(f"/api/config?userId={row['userId']}").get_json()
+        assert row["config"] == single
+
+
+def test_config_streams_large_experiment_sets(client, app_ctx, monkeypatch):
+    monkeypatch.setattr(app_ctx, "_STREAM_THRESHOLD", 2)
+    monkeypatch.setattr(app_ctx, "_STREAM_CHUNK_SIZE", 3)
+    for i in range(5):
+        app_ctx.db.experiments.insert_one({
+            "name": f"Experiment {i}",
+            "key": f"exp_{i}",
+            "status": "active",
+            "variants": [{"name": "A", "value": i, "traffic_percentage": 100}]
+        })
+
+    response = client.get('/api/config?userId=user-1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert sorted(entry["value"] for entry in response.get_json()) == [0, 1, 2, 3, 4]
+
+
+def test_login(client, admin_headers, app_ctx, monkeypatch):
+    good = client.post('/api/admin/login', json={"password": admin_headers["X-Admin-Key"]})
+    assert good.status_code == 200
+    assert client.post('/api/admin/login', json={"password": "wrong"}).status_code == 401
+    assert client.post('/api/admin/login', json={}).status_code == 401
+
+    monkeypatch.setattr(app_ctx, "_ADMIN_KEY_BYTES", None)
+    assert client.post('/api/admin/login', json={}).status_code == 401
+
+
+def test_cache_refreshes_right_after_boot(client, app_ctx, monkeypatch):
+    # time.monotonic() counts from boot, so it can be smaller than the TTL on a fresh host
+    monkeypatch.setattr(app_ctx.time, "monotonic", lambda: 1.0)
+    app_ctx.db.experiments.insert_one({
+        "name": "Fresh host",
+        "key": "fresh",
+        "status": "active",
+        "variants": [{"name": "A", "value": "on", "traffic_percentage": 100}]
+    })
+    app_ctx.invalidate_experiment_cache()
+
+    response = client.get('/api/config?userId=user-1')
+    assert [entry["key"] for entry in response.get_json()] == ["fresh"]
+
+
+def test_transient_write_error_keeps_the_batch(app_ctx, monkeypatch):
+    real_insert_many = app_ctx.db.events.insert_many
+
+    def unreachable(*args, **kwargs):
+        raise ServerSelectionTimeoutError("no primary")
+
+    batch = [{"user_id": "user-1", "event_name": "exposure"} for _ in range(3)]
+    monkeypatch.setattr(app_ctx.db.events, "insert_many", unreachable)
+    assert app_ctx._write_events(batch) is False
+
+    monkeypatch.setattr(app_ctx.db.events, "insert_many", real_insert_many)
+    assert app_ctx._write_events(batch) is True
+    assert app_ctx.db.events.count_documents({"user_id": "user-1"}) == 3
+
+
+def create_experiment(client, admin_headers, key="button_color"):
+    payload = {
+        "name": "Button colour",
+        "key": key,
+        "variants": [
+            {"name": "A", "value": "red", "traffic_percentage": 50},
+            {"name": "B", "value": "blue", "traffic_percentage": 50}
+        ]
+    }
+    response = client.post('/api/experiments', json=payload, headers=admin_headers)
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def test_summary_and_reset_endpoints(client, admin_headers, app_ctx):
+    exp_id = create_experiment(client, admin_headers)
+    for event in ("exposure", "conversion"):
+        client.post('/api/track', json={"userId": "user-1", "experimentId": exp_id, "variantName": "A", "event": event})
+    assert wait_for_events(app_ctx, {}, 2) == 2
+
+    response = client.get('/api/admin/summary/button_color', headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()["aggregated_variants"] == [{"_id": "A", "exposures": 1, "conversions": 1}]
+
+    response = client.delete('/api/admin/stats/button_color', headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json() == {"message": "Cleared 2 events"}
+
+    assert client.get('/api/admin/summary/missing', headers=admin_headers).status_code == 404
+    assert client.delete('/api/admin/stats/missing', headers=admin_headers).status_code == 404
+
+
+def test_summary_pivots_exposures_and_conversions(client, admin_headers, app_ctx):
+    exp_id = create_experiment(client, admin_headers)
+    events = [
+        ("A", "exposure"), ("A", "exposure"), ("A", "conversion"),
+        ("B", "exposure"),
+        (None, "exposure"),
+        ("A", "click")
+    ]
+    for variant_name, event in events:
+        body = {"userId": "user-1", "experimentId": exp_id, "event": event}
+        if variant_name:
+            body["variantName"] = variant_name
+        assert client.post('/api/track', json=body).status_code == 201
+    assert wait_for_events(app_ctx, {}, len(events)) == len(events)
+
+    response = client.get('/api/admin/summary/button_color', headers=admin_headers)
+    rows = sorted(response.get_json()["aggregated_variants"], key=lambda row: str(row["_id"]))
+    assert rows == [
+        {"_id": "A", "exposures": 2, "conversions": 1},
+        {"_id": "B", "exposures": 1, "conversions": 0},
+        {"_id": None, "exposures": 1, "conversions": 0}
+    ]
+
+
+def test_track_stores_experiment_id_as_object_id(client, admin_headers, app_ctx):
+    exp_id = create_experiment(client, admin_headers)
+    body = {"userId": "user-1", "experimentId": exp_id, "variantName": "A", "event": "exposure"}
+    assert client.post('/api/track', json=body).status_code == 201
+    assert wait_for_events(app_ctx, {}, 1) == 1
+
+    event = app_ctx.db.events.find_one()
+    assert isinstance(event["experiment_id"], ObjectId)
+    assert event["experiment_id"] == ObjectId(exp_id)
+
+
+def test_reset_only_deletes_that_experiments_events(client, admin_headers, app_ctx):
+    first_id = create_experiment(client, admin_headers, key="first")
+    second_id = create_experiment(client, admin_headers, key="second")
+    for exp_id in (first_id, first_id, second_id):
+        body = {"userId": "user-1", "experimentId": exp_id, "variantName": "A", "event": "exposure"}
+        assert client.post('/api/track', json=body).status_code == 201
+    assert wait_for_events(app_ctx, {}, 3) == 3
+
+    response = client.delete('/api/admin/stats/first', headers=admin_headers)
+    assert response.get_json() == {"message": "Cleared 2 events"}
+    assert app_ctx.db.events.count_documents({"experiment_id": ObjectId(second_id)}) == 1
+
+
+def test_duplicate_keys_do_not_block_startup(app_ctx):
+    app_ctx.db.experiments.drop_index("key_1")
+    app_ctx.db.experiments.insert_many([{"key": "dup"}, {"key": "dup"}])
+    app_ctx.ensure_indexes()
+    assert "key_1" not in app_ctx.db.experiments.index_information()
+
+    app_ctx.db.experiments.delete_many({})
+    app_ctx.ensure_indexes()
+    assert app_ctx.db.experiments.index_information()["key_1"]["unique"]